@@ -1,118 +1,264 @@
 import streamlit as st
 import pandas as pd
 import pyodbc
+import itertools
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from urllib.parse import quote_plus
 
+try:
+    import turbodbc
+except ImportError:  # optional: Arrow-native reads
+    turbodbc = None
+
 # Import authentication and audit modules
-from auth import check_authentication, show_login_page, show_logout_button, get_current_user, cleanup_expired_sessions
+from auth import check_authentication, show_login_page, show_logout_button, get_current_user, run_session_cleanup
 from audit import log_page_view, log_course_update, log_search_activity, log_user_login, log_user_logout
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Set ARROW_READS=1 (with turbodbc installed) to load parameterless queries via Arrow
+ARROW_READS = os.getenv('ARROW_READS') == '1' and turbodbc is not None
+
 # =============================================================================
 # DATABASE FUNCTIONS
 # =============================================================================
 
+def get_connection_string():
+    """Get the ODBC connection string for the current environment"""
+    env = os.getenv('ENVIRONMENT', 'test')
+    if env == 'prod':
+        return os.getenv('AZURE_SQL_PROD_CONNECTION_STRING')
+    return os.getenv('AZURE_SQL_TEST_CONNECTION_STRING')
+
 @st.cache_resource
 def get_engine():
     """Create SQLAlchemy engine using Azure SQL connection string"""
-    env = os.getenv('ENVIRONMENT', 'test')
-    if env == 'prod':
-        connection_string = os.getenv('AZURE_SQL_PROD_CONNECTION_STRING')
-    else:
-        connection_string = os.getenv('AZURE_SQL_TEST_CONNECTION_STRING')
+    connection_string = get_connection_string()
 
     # Convert pyodbc connection string to SQLAlchemy URL
     sqlalchemy_url = f"mssql+pyodbc:///?odbc_connect={quote_plus(connection_string)}"
-    return create_engine(sqlalchemy_url)
+    # fast_executemany lets pyodbc send batched inserts (audit log) as one array.
+    # Azure SQL drops idle connections, so recycle them before that happens and
+    # pre-ping on checkout; pyodbc connections are never shared outside the pool.
+    return create_engine(
+        sqlalchemy_url,
+        fast_executemany=True,
+        pool_pre_ping=True,
+        pool_size=10,
+        max_overflow=20,
+        pool_recycle=1800,
+        connect_args={'timeout': 5}
+    )
 
-def fetch_data(query):
-    """Execute SQL query and return DataFrame"""
+@st.cache_resource
+def get_arrow_connection():
+    """Open the shared turbodbc connection and the lock serializing its use"""
+    return turbodbc.connect(connection_string=get_connection_string()), threading.Lock()
+
+def fetch_arrow_table(query):
+    """Run a query on the shared turbodbc connection and return the Arrow table"""
+    conn, lock = get_arrow_connection()
+    with lock:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query)
+            return cursor.fetchallarrow()
+        finally:
+            cursor.close()
+
+def read_frame_arrow(query):
+    """Run a parameterless query through turbodbc and convert the Arrow table to pandas"""
     try:
-        engine = get_engine()
-        df = pd.read_sql(query, engine)
-        return df
+        table = fetch_arrow_table(query)
     except Exception as e:
-        st.error(f"Database-feil: {str(e)}")
-        return pd.DataFrame()
+        # Azure SQL drops idle connections; reconnect once before giving up on this read
+        logger.info("Arrow read failed, reconnecting: %s", e)
+        get_arrow_connection.clear()
+        table = fetch_arrow_table(query)
+    return table.to_pandas()
+
+def read_frame(query, params=None):
+    """Run a query and build a DataFrame straight from the fetched rows"""
+    # Only the bulk course list runs without parameters; single-course lookups stay on the pool
+    if ARROW_READS and not params:
+        try:
+            return read_frame_arrow(query)
+        except Exception as e:
+            logger.warning("Arrow read failed, falling back to pyodbc: %s", e)
+
+    engine = get_engine()
+    with engine.connect() as conn:
+        result = conn.execute(text(query), params or {})
+        return pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()))
+
+
+# Display labels for raw coursedates values; unmapped values are shown as-is
+STATUS_MAP = {
+    'Will run': 'Gjennomføres',
+    'To be defined': 'Uavklart',
+}
+LOCATION_MAP = {
+    '': 'Nettstudier',
+    'Norway': 'Bedriftskurs',
+    'Nett': 'Nettundervisning',
+}
+
+def format_course_columns(df):
+    """Format raw date/time/status/location columns from a coursedates query for display"""
+    if df.empty:
+        return df
+
+    df['Startdato'] = pd.to_datetime(df['start_date']).dt.strftime('%d.%m.%Y')
+    df['Sluttdato'] = pd.to_datetime(df['end_date']).dt.strftime('%d.%m.%Y')
+    if 'start_time' in df:
+        # TIME values come back as datetime.time, whose string form starts with HH:MM
+        df['Tid'] = (
+            df['start_time'].astype('string').str[:5] + ' - ' +
+            df['end_time'].astype('string').str[:5]
+        )
+    # Translate the distinct values only: as categoricals, map() touches each
+    # category once instead of every row
+    status = df['Status'].astype('category')
+    df['Status'] = status.map({raw: STATUS_MAP.get(raw, raw) for raw in status.cat.categories})
+    location = df['location'].fillna('').astype('category')
+    df['Sted'] = location.map({raw: LOCATION_MAP.get(raw, raw) for raw in location.cat.categories})
+    return df.drop(columns=['start_date', 'end_date', 'start_time', 'end_time'], errors='ignore')
+
+# Search terms shorter than this are filtered client-side on the full course list
+SEARCH_PUSHDOWN_MIN_CHARS = 3
+
+def escape_like(term):
+    """Escape LIKE wildcards so the search term is matched literally"""
+    return term.replace('[', '[[]').replace('%', '[%]').replace('_', '[_]')
+
+def label_search_filter(column, labels, search, name):
+    """
+    Build a SQL predicate matching `column` by its display label.
 
+    Raw values in `labels` match when their label contains the search term;
+    any other value matches on its raw text via the `:q` LIKE pattern.
+    """
+    needle = search.lower()
+    params = {f"{name}_{i}": raw for i, raw in enumerate(labels)}
+    mapped = ", ".join(f":{key}" for key in params)
+    clause = f"({column} LIKE :q AND {column} NOT IN ({mapped}))"
+
+    hits = [f":{key}" for key, raw in params.items() if needle in labels[raw].lower()]
+    if hits:
+        clause += f" OR {column} IN ({', '.join(hits)})"
+    return clause, params
+
+@st.cache_resource(ttl=300, max_entries=64, show_spinner=False)
+def load_courses(search=None, version=0):
+    """
+    Load the course list for the datasheet (cached for 5 minutes across reruns).
 
-def get_courses_data():
-    """Get all courses data with formatting"""
+    The frame is shared between sessions, so callers go through
+    get_courses_data() for a private copy. `version` is not used in the query;
+    it only partitions the cache so a new version forces a fresh load.
+
+    Only the columns shown in the datasheet are selected; get_course_by_id
+    fetches the full row for the details page. When a search term is given,
+    the title/Sted/Status match is done by SQL Server so only matching rows
+    are transferred.
+    """
     query = """
+    SET NOCOUNT ON;
     SELECT
-        cd.id,
         cd.frontcore_id AS KursdatoID,
         cd.title AS Tittel,
         cd.location,
-        FORMAT(cd.start_date, 'dd.MM.yyyy') AS Startdato,
-        FORMAT(cd.end_date, 'dd.MM.yyyy') AS Sluttdato,
-        CASE
-            WHEN cd.Status = 'Will run' THEN 'Gjennomføres'
-            WHEN cd.Status = 'To be defined' THEN 'Uavklart'
-            ELSE cd.Status
-        END AS Status,
-        CONVERT(VARCHAR(5), cd.start_time, 108) + ' - ' + CONVERT(VARCHAR(5), cd.end_time, 108) AS Tid,
-        cd.department_number AS Avdelingsnummer,
-        cd.billed AS Fakturert,
-        cd.responsible AS Ansvarlig,
-        cd.who_billed AS [Hvem fakturerte],
-        cd.notes AS [Notater],
-        CASE
-            WHEN cd.location IS NULL OR cd.location = ''
-            THEN 'Nettstudier'
-            WHEN cd.location = 'Norway' THEN 'Bedriftskurs'
-            WHEN cd.location = 'Nett' THEN 'Nettundervisning'
-            ELSE cd.location
-        END AS Sted
+        cd.start_date,
+        cd.end_date,
+        cd.Status,
+        cd.billed AS Fakturert
     FROM
         coursedates AS cd
     WHERE ((cd.start_date >= '2025-08-01' AND cd.start_date <= '2025-10-01')
         OR (cd.end_date >= '2025-08-01' AND cd.end_date <= '2025-12-20'))
+    {search_filter}
     ORDER BY cd.start_date DESC
     """
-    return fetch_data(query)
+    params = None
+    search_filter = ""
+    if search:
+        status_sql, status_params = label_search_filter("cd.Status", STATUS_MAP, search, "status")
+        location_sql, location_params = label_search_filter(
+            "ISNULL(cd.location, '')", LOCATION_MAP, search, "location"
+        )
+        search_filter = f"AND (cd.title LIKE :q OR {status_sql} OR {location_sql})"
+        params = {"q": f"%{escape_like(search)}%", **status_params, **location_params}
+    df = format_course_columns(read_frame(query.format(search_filter=search_filter), params=params))
+    if not df.empty:
+        # Lowercased search text, built once per load instead of on every search.
+        # The unit separator keeps a match from spanning two columns. Arrow-backed
+        # strings make str.contains run in Arrow's C++ kernel instead of a Python loop.
+        df['_search_blob'] = (
+            df['Tittel'].astype('string').fillna('') + '\x1f' +
+            df['Sted'].astype('string').fillna('') + '\x1f' +
+            df['Status'].astype('string').fillna('')
+        ).str.lower().astype('string[pyarrow]')
+        # Status/Sted have a handful of distinct values; store them as category codes
+        df = df.astype({'Status': 'category', 'Sted': 'category'})
+        df['Fakturert'] = df['Fakturert'].fillna(False).astype(bool)
+    return df
+
+@st.cache_resource
+def get_courses_version_counter():
+    """Process-wide source of course list versions; next() on it is atomic under the GIL"""
+    return itertools.count(1)
+
+def get_courses_data(search=None):
+    """Get the course list at this session's data version"""
+    # Errors are handled out here: a raised call isn't cached, so the next rerun retries
+    try:
+        return load_courses(search, st.session_state.get('courses_version', 0)).copy()
+    except Exception as e:
+        st.error(f"Database-feil: {str(e)}")
+        return pd.DataFrame()
+
+def invalidate_courses():
+    """Make this session's next course list read go to the database"""
+    # Versions are never reused across sessions, so the new key can't hit another session's cached frame
+    st.session_state.courses_version = next(get_courses_version_counter())
 
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
 def get_course_by_id(course_id):
-    """Get specific course data by frontcore_id"""
-    query = f"""
+    """Get specific course data by frontcore_id (cached per course for 5 minutes)"""
+    query = """
     SELECT
         cd.id,
         cd.frontcore_id AS KursdatoID,
         cd.title AS Tittel,
         cd.location,
-        FORMAT(cd.start_date, 'dd.MM.yyyy') AS Startdato,
-        FORMAT(cd.end_date, 'dd.MM.yyyy') AS Sluttdato,
-        CASE
-            WHEN cd.Status = 'Will run' THEN 'Gjennomføres'
-            WHEN cd.Status = 'To be defined' THEN 'Uavklart'
-            ELSE cd.Status
-        END AS Status,
-        CONVERT(VARCHAR(5), cd.start_time, 108) + ' - ' + CONVERT(VARCHAR(5), cd.end_time, 108) AS Tid,
+        cd.start_date,
+        cd.end_date,
+        cd.Status,
+        cd.start_time,
+        cd.end_time,
         cd.department_number AS Avdelingsnummer,
         cd.billed AS Fakturert,
         cd.responsible AS Ansvarlig,
         cd.who_billed AS [Hvem fakturerte],
-        cd.notes AS [Notater],
-        CASE
-            WHEN cd.location IS NULL OR cd.location = ''
-            THEN 'Nettstudier'
-            WHEN cd.location = 'Norway' THEN 'Bedriftskurs'
-            WHEN cd.location = 'Nett' THEN 'Nettundervisning'
-            ELSE cd.location
-        END AS Sted
+        cd.notes AS [Notater]
     FROM
         coursedates AS cd
-    WHERE cd.frontcore_id = '{course_id}'
+    WHERE cd.frontcore_id = :cid
     """
-    return fetch_data(query)
+    return format_course_columns(read_frame(query, params={"cid": course_id}))
 
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
 def get_course_instructors(course_id):
-    """Get instructors for a specific course by frontcore_id"""
+    """Get instructors for a specific course by frontcore_id (cached per course for 5 minutes)"""
     query = """
     SELECT
         i.full_name,
@@ -125,20 +271,49 @@ def get_course_instructors(course_id):
     FROM instructors i
     INNER JOIN instructors_coursedates ic ON i.id = ic.instructor_id
     INNER JOIN coursedates cd ON ic.coursedate_id = cd.id
-    WHERE cd.frontcore_id = ?
+    WHERE cd.frontcore_id = :cid
     ORDER BY i.full_name
     """
+    return read_frame(query, {"cid": course_id})
+
+@st.cache_data(ttl=300, max_entries=128, show_spinner=False)
+def get_instructor_display(course_id):
+    """Get the instructors table for a course, already shaped for display"""
+    instructors_df = get_course_instructors(course_id)
+    if instructors_df.empty:
+        return instructors_df
+    return build_instructor_display(instructors_df)
+
+def get_course_details(course_id):
+    """
+    Fetch a course row and its display-ready instructors table in parallel.
+
+    Each query checks out its own pooled connection, so the page waits for the
+    slower of the two round-trips rather than both. A failed query is reported
+    here, outside the caches, and its frame comes back as None.
+    """
+    # Worker threads need the script context for st.cache_data
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        course_future = executor.submit(get_course_by_id, course_id)
+        instructors_future = executor.submit(get_instructor_display, course_id)
+
     try:
-        engine = get_engine()
-        with engine.connect() as conn:
-            df = pd.read_sql(query, conn, params=(course_id,))
-        return df
+        course_df = course_future.result()
+    except Exception as e:
+        st.error(f"Database-feil: {str(e)}")
+        course_df = None
+
+    try:
+        instructors_df = instructors_future.result()
     except Exception as e:
-        print(f"Error fetching course instructors for course {course_id}: {e}")
+        logger.warning("Error fetching course instructors for course %s: %s", course_id, e)
         # Check if the error is due to missing tables
         if "Invalid object name 'instructors'" in str(e) or "Invalid object name 'instructors_coursedates'" in str(e):
-            print("Instructor tables not found - they may not be created yet")
-        return pd.DataFrame()
+            logger.warning("Instructor tables not found - they may not be created yet")
+        instructors_df = None
+
+    return course_df, instructors_df
 
 # =============================================================================
 # UTILITY FUNCTIONS
@@ -147,74 +322,64 @@ def get_course_instructors(course_id):
 def filter_courses(courses_df, search_term):
     """Filter courses based on search term"""
     if search_term:
-        mask = (
-            courses_df['Tittel'].str.contains(search_term, case=False, na=False) |
-            courses_df['Sted'].str.contains(search_term, case=False, na=False) |
-            courses_df['Status'].str.contains(search_term, case=False, na=False)
-        )
+        # Single literal scan over the search text precomputed in load_courses()
+        mask = courses_df['_search_blob'].str.contains(search_term.lower(), regex=False, na=False)
         return courses_df[mask]
     return courses_df
 
+def build_instructor_display(instructors_df):
+    """Build the instructors table for the details page with column-wise operations"""
+    def text_or(column, default):
+        values = instructors_df[column]
+        return values.where(values.fillna('') != '', default)
+
+    def yes_no(column):
+        return instructors_df[column].fillna(False).astype(bool).map({True: 'Ja', False: 'Nei'})
+
+    return pd.DataFrame({
+        'Navn': instructors_df['full_name'],
+        'E-post': text_or('email', 'Ikke oppgitt'),
+        'Telefon': text_or('phone_number', 'Ikke oppgitt'),
+        'Ny instruktør': yes_no('new_instructor'),
+        'Kontrakt sendt': yes_no('contract_sent'),
+        'Kontrakt signert': yes_no('contract_signed'),
+        'Notater': text_or('instructor_notes', 'Ingen notater'),
+    })
+
 def get_display_columns():
     """Get the columns to display in the datasheet"""
     return ['Tittel', 'KursdatoID', 'Sted', 'Startdato', 'Sluttdato', 'Status', 'Fakturert']
 
 def initialize_session_state():
     """Initialize session state variables"""
-    if 'selected_course_id' not in st.session_state:
-        st.session_state.selected_course_id = None
-    if 'should_redirect' not in st.session_state:
-        st.session_state.should_redirect = False
-    if 'current_page' not in st.session_state:
-        st.session_state.current_page = "Kursoversikt"
-
-    # Audit logging tracking to prevent duplicate page view logs
-    if 'last_logged_page' not in st.session_state:
-        st.session_state.last_logged_page = None
-    if 'last_logged_course_id' not in st.session_state:
-        st.session_state.last_logged_course_id = None
+    ss = st.session_state
+    ss.setdefault('selected_course_id', None)
+    ss.setdefault('should_redirect', False)
+    ss.setdefault('current_page', "Kursoversikt")
+
+    # Last logged (page, course_id), to prevent duplicate page view logs
+    ss.setdefault('_nav_sig', None)
 
 def smart_log_page_view(page_name: str, course_id: str = None):
     """
-    Smart page view logging that only logs actual navigation events.
+    Log a navigation event and remember it as the current navigation signature.
 
-    This prevents logging every form field change as a "page view".
-    Only logs when user actually navigates to a different page or course.
+    The router compares (page, course_id) with st.session_state._nav_sig before
+    calling this, so plain form reruns never reach it and never log a "page view".
 
     Args:
         page_name: Name of the page being viewed
         course_id: Course ID if viewing course details
     """
-    # Get current state
-    current_page = page_name
-    current_course = course_id
-
-    # Get last logged state
-    last_page = st.session_state.get('last_logged_page')
-    last_course = st.session_state.get('last_logged_course_id')
-
-    # Only log if this is actually a new navigation event
-    if current_page != last_page or current_course != last_course:
-        # This is a real navigation - log it
-        log_page_view(page_name, course_id)
-
-        # Update tracking to prevent duplicate logs
-        st.session_state.last_logged_page = current_page
-        st.session_state.last_logged_course_id = current_course
-
-        # Debug info (can be removed later)
-        print(f"📊 SMART AUDIT: Logged page view - {page_name}" +
-              (f" (Course: {course_id})" if course_id else ""))
-    else:
-        # This is just a form rerun - don't log
-        print(f"🔄 SMART AUDIT: Skipped duplicate log - {page_name}" +
-              (f" (Course: {course_id})" if course_id else ""))
+    log_page_view(page_name, course_id)
+    st.session_state._nav_sig = (page_name, course_id)
 
+    # Lazy %-formatting: nothing is built unless DEBUG logging is enabled
+    logger.debug("📊 SMART AUDIT: Logged page view - %s (Course: %s)", page_name, course_id)
 
-def add_hyperlink_css():
-    """Add CSS styling for hyperlink appearance in dataframes"""
-    st.markdown("""
-    <style>
+
+HYPERLINK_CSS = """
+    /* Hyperlink appearance in dataframes */
     .dataframe td:nth-child(1), .dataframe td:nth-child(2) {
         color: #0066cc !important;
         text-decoration: underline !important;
@@ -223,23 +388,16 @@ def add_hyperlink_css():
     .dataframe td:nth-child(1):hover, .dataframe td:nth-child(2):hover {
         color: #004499 !important;
     }
-    </style>
-    """, unsafe_allow_html=True)
+"""
 
-def add_dynamic_height_css():
-    """Add CSS for dynamic dataframe height calculation"""
-    st.markdown("""
-    <style>
+DYNAMIC_HEIGHT_CSS = """
+    /* Dynamic dataframe height calculation */
     .stDataFrame > div {
         height: calc(100vh - 400px) !important;
     }
-    </style>
-    """, unsafe_allow_html=True)
+"""
 
-def add_compact_css():
-    """Add CSS for compact layout to minimize scrolling"""
-    st.markdown("""
-    <style>
+COMPACT_CSS = """
     /* Reduce general spacing */
     .block-container {
         padding-top: 2rem !important;
@@ -272,8 +430,17 @@ def add_compact_css():
         padding-left: 0.5rem !important;
         padding-right: 0.5rem !important;
     }
-    </style>
-    """, unsafe_allow_html=True)
+"""
+
+# One prebuilt <style> block per page, so each rerun sends a single CSS element
+PAGE_STYLES = {
+    "Kursoversikt": f"<style>{HYPERLINK_CSS}{DYNAMIC_HEIGHT_CSS}</style>",
+    "Kursdetaljer": f"<style>{HYPERLINK_CSS}{COMPACT_CSS}</style>",
+}
+
+def add_page_css(page):
+    """Add the combined CSS for the given page"""
+    st.markdown(PAGE_STYLES[page], unsafe_allow_html=True)
 
 # =============================================================================
 # PAGE COMPONENTS
@@ -283,31 +450,47 @@ def add_compact_css():
 def show_courses_datasheet_page():
     """Display the courses datasheet page"""
     st.header("Kursoversikt")
+    show_courses_datasheet()
 
-    # Search functionality
-    search_term = st.text_input(
-        "Søk i kurs",
-        placeholder="Søk etter tittel, sted eller status...",
-        key="search_input_simple"
-    )
+@st.fragment
+def show_courses_datasheet():
+    """
+    Search form and course table.
 
-    # Get and filter courses data
-    courses_df = get_courses_data()
+    Runs as a fragment, so searching, refreshing and selecting rows rerun only
+    this block instead of the sidebar, auth checks and navigation. Selecting a
+    course calls st.rerun(), which reruns the whole app to switch pages.
+    """
+    # Bump the data version so the next fetch hits the database
+    if st.button("Oppdater"):
+        invalidate_courses()
+
+    # Search functionality; the form only reruns the script on Enter or the Søk button
+    with st.form("search_form"):
+        search_term = st.text_input(
+            "Søk i kurs",
+            placeholder="Søk etter tittel, sted eller status...",
+            key="search_input_simple"
+        )
+        st.form_submit_button("Søk")
+
+    # Get and filter courses data; longer terms are matched by the database
+    pushdown_term = search_term if len(search_term) >= SEARCH_PUSHDOWN_MIN_CHARS else None
+    courses_df = get_courses_data(pushdown_term)
     if not courses_df.empty:
         filtered_df = filter_courses(courses_df, search_term)
 
-        # Log search activity for GDPR compliance
-        if search_term:
+        # Log search activity for GDPR compliance, once per submitted term rather
+        # than on every rerun (row clicks, refresh) that still carries it
+        if search_term and search_term != st.session_state.get('last_search'):
             log_search_activity(search_term, len(filtered_df))
+        st.session_state.last_search = search_term
 
-        # Select display columns and reset index
+        # Select display columns; the index is hidden in the table, so it isn't reset
         display_columns = get_display_columns()
-        display_df = filtered_df[display_columns].reset_index(drop=True)
+        display_df = filtered_df.filter(items=display_columns)
 
-        # Initialize session state and add styling
         initialize_session_state()
-        add_hyperlink_css()
-        add_dynamic_height_css()
 
         st.write(f"Fant {len(display_df)} kurs")
 
@@ -316,6 +499,7 @@ def show_courses_datasheet_page():
             display_df,
             height=400,  # Base height, CSS will override with dynamic calculation
             width='stretch',
+            hide_index=True,
             on_select="rerun",
             selection_mode="single-row"
         )
@@ -328,6 +512,8 @@ def show_courses_datasheet_page():
             st.session_state.selected_course_id = selected_course['KursdatoID']
             st.session_state.should_redirect = True
             st.rerun()
+    elif pushdown_term:
+        st.write("Fant 0 kurs")
     else:
         st.warning("Ingen kurs funnet eller problem med databaseforbindelse")
 
@@ -336,23 +522,31 @@ def show_course_details_page():
     st.header("Kursdetaljer")
 
     if 'selected_course_id' in st.session_state and st.session_state.selected_course_id:
-        course_df = get_course_by_id(st.session_state.selected_course_id)
-
-        if not course_df.empty:
-            course_data = course_df.iloc[0]
-
-            # Apply compact CSS for minimal scrolling
-            add_compact_css()
+        # Keep the selected course in session state so widget reruns don't refetch it
+        course_id = st.session_state.selected_course_id
+        if st.session_state.get('cached_course_id') != course_id:
+            course_df, instructors_df = get_course_details(course_id)
+            st.session_state.cached_course_df = course_df
+            st.session_state.cached_instructors_df = instructors_df
+            # Only keep complete reads, so a failed query is retried on the next rerun
+            if course_df is not None and instructors_df is not None:
+                st.session_state.cached_course_id = course_id
+        course_df = st.session_state.cached_course_df
+
+        if course_df is not None and not course_df.empty:
+            course_data = course_df.iloc[0].to_dict()
 
             # Back button
             if st.button("Tilbake til kursoversikt"):
                 st.session_state.selected_course_id = None
                 st.session_state.should_redirect = False
                 st.session_state.current_page = "Kursoversikt"
+                st.session_state.cached_course_id = None
+                st.session_state.cached_course_df = None
+                st.session_state.cached_instructors_df = None
 
                 # Reset audit logging tracking to ensure back navigation gets logged
-                st.session_state.last_logged_page = None
-                st.session_state.last_logged_course_id = None
+                st.session_state._nav_sig = None
                 st.rerun()
 
             st.subheader(f"{course_data['Tittel']}")
@@ -385,29 +579,17 @@ def show_course_details_page():
             # Compact Instructors Section
             st.markdown("### Instruktører")
 
-            # Get instructors for this course
-            instructors_df = get_course_instructors(st.session_state.selected_course_id)
-
-            if not instructors_df.empty:
-                # Create a complete display table with all details
-                display_data = []
-                for idx, instructor in instructors_df.iterrows():
-                    display_data.append({
-                        'Navn': instructor['full_name'],
-                        'E-post': instructor['email'] if pd.notna(instructor['email']) and instructor['email'] else 'Ikke oppgitt',
-                        'Telefon': instructor['phone_number'] if pd.notna(instructor['phone_number']) and instructor['phone_number'] else 'Ikke oppgitt',
-                        'Ny instruktør': 'Ja' if instructor['new_instructor'] else 'Nei',
-                        'Kontrakt sendt': 'Ja' if instructor['contract_sent'] else 'Nei',
-                        'Kontrakt signert': 'Ja' if instructor['contract_signed'] else 'Nei',
-                        'Notater': instructor['instructor_notes'] if pd.notna(instructor['instructor_notes']) and instructor['instructor_notes'] else 'Ingen notater'
-                    })
+            # Instructors were fetched alongside the course row
+            instructors_df = st.session_state.cached_instructors_df
 
+            if instructors_df is None:
+                st.warning("Kunne ikke hente instruktører for dette kurset.")
+            elif not instructors_df.empty:
                 # Display as complete table
-                complete_df = pd.DataFrame(display_data)
-                st.dataframe(complete_df, width='stretch', hide_index=True)
+                st.dataframe(instructors_df, width='stretch', hide_index=True)
             else:
                 st.info("Ingen instruktører registrert for dette kurset.")
-        else:
+        elif course_df is not None:
             st.warning("Kurs ikke funnet")
     else:
         st.info("Ingen kurs valgt. Gå til kursoversikten og klikk på en kurstittel eller ID.")
@@ -416,6 +598,9 @@ def show_course_details_page():
 # MAIN APPLICATION
 # =============================================================================
 
+PAGE_OPTIONS = ["Kursoversikt", "Kursdetaljer"]
+PAGE_INDEX = {page: index for index, page in enumerate(PAGE_OPTIONS)}
+
 def main():
     """
     Main application function with authentication wrapper.
@@ -432,10 +617,8 @@ def main():
         initial_sidebar_state="expanded"
     )
 
-    # Clean up expired sessions on app startup (run once per session)
-    if 'session_cleanup_done' not in st.session_state:
-        cleanup_expired_sessions()
-        st.session_state.session_cleanup_done = True
+    # Clean up expired sessions; shared by all sessions in this process
+    run_session_cleanup()
 
     # Check authentication status
     if not check_authentication():
@@ -478,13 +661,12 @@ def show_authenticated_dashboard():
         st.session_state.should_redirect = False  # Reset flag after redirect
 
     # Get current page index for selectbox
-    page_options = ["Kursoversikt", "Kursdetaljer"]
-    current_index = page_options.index(st.session_state.current_page)
+    current_index = PAGE_INDEX[st.session_state.current_page]
 
     # Navigation selectbox with proper default
     page = st.sidebar.selectbox(
         "Velg visning",
-        page_options,
+        PAGE_OPTIONS,
         index=current_index
     )
 
@@ -492,13 +674,18 @@ def show_authenticated_dashboard():
     if page != st.session_state.current_page:
         st.session_state.current_page = page
 
-    # Route to appropriate page with smart audit logging
+    # Page CSS is sent on every run: Streamlit drops elements a rerun doesn't re-emit
+    add_page_css(page)
+
+    # Smart audit logging: only actual navigation changes the signature
+    course_id = st.session_state.get('selected_course_id') if page == "Kursdetaljer" else None
+    if (page, course_id) != st.session_state._nav_sig:
+        smart_log_page_view(page, course_id)
+
+    # Route to appropriate page
     if page == "Kursoversikt":
-        smart_log_page_view("Kursoversikt")  # Only logs actual navigation
         show_courses_datasheet_page()
     elif page == "Kursdetaljer":
-        course_id = st.session_state.get('selected_course_id')
-        smart_log_page_view("Kursdetaljer", course_id)  # Only logs actual navigation
         show_course_details_page()
 
 # Run the application
@@ -3,10 +3,83 @@ Simple Audit Logging System
 """
 
 import streamlit as st
-import pandas as pd
 from datetime import datetime
+import atexit
 import json
+import logging
+import queue
+import threading
+import time
 from typing import Dict, Any, Optional
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Audit rows are queued here and written in batches by a background thread
+audit_queue = queue.Queue()
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 5  # seconds
+
+AUDIT_INSERT = text("""
+INSERT INTO audit_log (user_name, action, table_name, record_id, timestamp)
+VALUES (:user_name, :action, :table_name, :record_id, :timestamp)
+""")
+
+_writer_lock = threading.Lock()
+_writer_thread = None
+
+# Set once the audit_log DDL has run in this process
+_AUDIT_TABLE_READY = False
+
+def _write_audit_rows(rows):
+    """Insert a batch of audit rows with one executemany."""
+    try:
+        import app
+        engine = app.get_engine()
+        with engine.begin() as conn:
+            conn.execute(AUDIT_INSERT, rows)
+    except Exception as e:
+        logger.error("❌ Audit logging failed for %d rows: %s", len(rows), e)
+
+def _collect_audit_batch():
+    """Block for the next audit row, then gather more until the batch is full or the interval passes."""
+    rows = [audit_queue.get()]
+    deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+    while len(rows) < AUDIT_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            rows.append(audit_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return rows
+
+def _audit_writer():
+    """Background loop that drains the audit queue."""
+    while True:
+        _write_audit_rows(_collect_audit_batch())
+
+def _start_audit_writer():
+    """Start the background audit writer once per process."""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_audit_writer, name="audit-writer", daemon=True)
+            _writer_thread.start()
+
+def flush_audit():
+    """Write all queued audit rows immediately."""
+    rows = []
+    while True:
+        try:
+            rows.append(audit_queue.get_nowait())
+        except queue.Empty:
+            break
+    if rows:
+        _write_audit_rows(rows)
+
+atexit.register(flush_audit)
 
 class AuditLogger:
     """Simple audit logging system."""
@@ -16,7 +89,11 @@ class AuditLogger:
         self._ensure_audit_table_exists()
 
     def _ensure_audit_table_exists(self):
-        """Create simple audit_log table."""
+        """Create simple audit_log table (once per process)."""
+        global _AUDIT_TABLE_READY
+        if _AUDIT_TABLE_READY:
+            return
+
         create_table_sql = """
         IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='audit_log' AND xtype='U')
         BEGIN
@@ -33,16 +110,15 @@ class AuditLogger:
 
         try:
             import app
-            from sqlalchemy import text
             engine = app.get_engine()
-            with engine.connect() as conn:
+            with engine.begin() as conn:
                 conn.execute(text(create_table_sql))
-                conn.commit()
+            _AUDIT_TABLE_READY = True
         except Exception as e:
-            print(f"⚠️ Could not create audit table: {e}")
+            logger.warning("⚠️ Could not create audit table: %s", e)
 
     def log_action(self, action: str, table_name: str = None, record_id: str = None):
-        """Log a simple action."""
+        """Queue a simple action for the background audit writer."""
         try:
             from auth import get_current_user
             current_user = get_current_user()
@@ -60,12 +136,11 @@ class AuditLogger:
                 'timestamp': datetime.now()
             }
 
-            import app
-            engine = app.get_engine()
-            df = pd.DataFrame([audit_entry])
-            df.to_sql('audit_log', engine, if_exists='append', index=False)
+            # User info lives in session state, so resolve it here and leave only the write to the thread
+            _start_audit_writer()
+            audit_queue.put(audit_entry)
         except Exception as e:
-            print(f"❌ Audit logging failed: {e}")
+            logger.error("❌ Audit logging failed: %s", e)
 
 # Global audit logger instance
 audit_logger = None
@@ -95,12 +170,14 @@ def log_search_activity(search_term: str, results_count: int):
     logger.log_action(f'search_{search_term}', 'coursedates')
 
 def log_user_login(success: bool, user_id: str = None, error: str = None):
-    """Log authentication events."""
+    """Log authentication events and write them out immediately."""
     logger = get_audit_logger()
     action = 'login_success' if success else 'login_failure'
     logger.log_action(action, 'authentication')
+    flush_audit()
 
 def log_user_logout():
-    """Log user logout."""
+    """Log user logout and write it out immediately."""
     logger = get_audit_logger()
-    logger.log_action('logout', 'authentication')
\ No newline at end of file
+    logger.log_action('logout', 'authentication')
+    flush_audit()
\ No newline at end of file
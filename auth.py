@@ -3,15 +3,46 @@ Simple Azure AD Authentication for Streamlit
 """
 
 import streamlit as st
+import logging
 import msal
 import os
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from session_manager import get_session_manager
+from audit import log_user_login, log_user_logout
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Shared HTTP session so Graph calls reuse the pooled keep-alive TLS connection
+_GRAPH = requests.Session()
+_GRAPH.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_GRAPH.headers.update({
+    'Accept-Encoding': 'gzip',
+    'User-Agent': 'Kursadmin-dashboard',
+})
+
+@st.cache_resource
+def _build_msal_app(client_id, client_secret, authority):
+    """Create the MSAL application once per process and configuration."""
+    return msal.ConfidentialClientApplication(
+        client_id=client_id,
+        client_credential=client_secret,
+        authority=authority
+    )
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _build_auth_url(client_id, client_secret, authority, redirect_uri, scopes):
+    """Build the Azure AD login URL; it only depends on configuration, so every login page can share it."""
+    app = _build_msal_app(client_id, client_secret, authority)
+    return app.get_authorization_request_url(
+        scopes=list(scopes),
+        redirect_uri=redirect_uri
+    )
+
 class AzureADAuth:
     """Simple Azure AD authentication handler."""
 
@@ -27,24 +58,18 @@ class AzureADAuth:
             raise ValueError("Missing Azure AD configuration")
 
     def get_msal_app(self):
-        """Create MSAL application instance."""
-        return msal.ConfidentialClientApplication(
-            client_id=self.client_id,
-            client_credential=self.client_secret,
-            authority=self.authority
-        )
+        """Get the shared MSAL application instance."""
+        return _build_msal_app(self.client_id, self.client_secret, self.authority)
 
     def get_auth_url(self):
         """Generate Azure AD login URL."""
-        app = self.get_msal_app()
-        return app.get_authorization_request_url(
-            scopes=self.scopes,
-            redirect_uri=self.redirect_uri
-        )
-
-    def handle_auth_callback(self):
-        """Handle callback from Azure AD."""
-        code = st.query_params.get('code')
+        return _build_auth_url(self.client_id, self.client_secret, self.authority,
+                               self.redirect_uri, tuple(self.scopes))
+
+    def handle_auth_callback(self, code=None):
+        """Handle callback from Azure AD; pass code if the caller already read it from the query params."""
+        if code is None:
+            code = st.query_params.get('code')
         if not code:
             return False
 
@@ -72,12 +97,20 @@ class AzureADAuth:
                     if session_id:
                         session_mgr.set_session_cookie(session_id)
 
+                    log_user_login(True, user_info.get('id'))
+
                     # Clear URL parameters
                     st.query_params.clear()
                     return True
 
+            # Authorization codes are single-use; drop it so reruns don't redeem and log it again
+            st.query_params.clear()
+            log_user_login(False, error=result.get('error_description') or result.get('error'))
+
         except Exception as e:
             st.error(f"Autentisering feilet: {e}")
+            st.query_params.clear()
+            log_user_login(False, error=str(e))
 
         return False
 
@@ -85,11 +118,11 @@ class AzureADAuth:
         """Get user info from Microsoft Graph."""
         try:
             headers = {'Authorization': f'Bearer {access_token}'}
-            response = requests.get('https://graph.microsoft.com/v1.0/me', headers=headers)
+            response = _GRAPH.get('https://graph.microsoft.com/v1.0/me', headers=headers, timeout=5)
             if response.status_code == 200:
                 return response.json()
         except Exception as e:
-            print(f"Failed to get user info: {e}")
+            logger.warning("Failed to get user info: %s", e)
         return None
 
     def is_authenticated(self):
@@ -118,6 +151,9 @@ class AzureADAuth:
 
     def logout(self):
         """Logout user."""
+        # Log while the user is still in session state
+        log_user_logout()
+
         # Clear persistent session
         session_mgr = get_session_manager()
         session_mgr.clear_session_cookie()
@@ -132,9 +168,18 @@ azure_auth = AzureADAuth()
 # Simple convenience functions
 def check_authentication():
     """Check if user is authenticated."""
+    # Logged-in reruns skip the callback check and cookie decryption entirely
+    token_expiry = st.session_state.get('token_expiry')
+    if st.session_state.get('authenticated') and token_expiry and datetime.now() < token_expiry:
+        return True
+
+    # Read the session cookies once; everything below uses the snapshot
+    get_session_manager().prime_cookie_cache()
+
     # Handle auth callback first
-    if st.query_params.get('code'):
-        azure_auth.handle_auth_callback()
+    code = st.query_params.get('code')
+    if code:
+        azure_auth.handle_auth_callback(code)
 
     return azure_auth.is_authenticated()
 
@@ -148,13 +193,13 @@ def show_login_page():
 
     # Try to get session cookie directly from session manager
     if 'login_cookie_check' not in st.session_state:
-        print(f"🔍 LOGIN PAGE: Checking for existing session...")
+        logger.debug("🔍 LOGIN PAGE: Checking for existing session...")
         session_id = session_mgr.get_session_cookie()
         if session_id:
-            print(f"🔍 LOGIN PAGE: Found session ID from cookie: {session_id[:8]}...")
+            logger.debug("🔍 LOGIN PAGE: Found session ID from cookie: %.8s...", session_id)
             user_info = session_mgr.validate_session(session_id)
             if user_info:
-                print(f"✅ LOGIN PAGE: Session valid - restoring authentication for {user_info.get('displayName', 'Unknown')}")
+                logger.debug("✅ LOGIN PAGE: Session valid - restoring authentication for %s", user_info.get('displayName', 'Unknown'))
                 # Restore session state
                 st.session_state.authenticated = True
                 st.session_state.user_info = user_info
@@ -163,35 +208,33 @@ def show_login_page():
                 st.session_state.auth_timestamp = datetime.now()
                 st.session_state.current_session_id = session_id
 
-                print(f"🔄 LOGIN PAGE: Authentication restored, refreshing...")
+                logger.debug("🔄 LOGIN PAGE: Authentication restored, refreshing...")
                 st.rerun()
             else:
-                print(f"❌ LOGIN PAGE: Session invalid - will show login form")
+                logger.debug("❌ LOGIN PAGE: Session invalid - will show login form")
         else:
-            print(f"❌ LOGIN PAGE: No session cookie found - will show login form")
+            logger.debug("❌ LOGIN PAGE: No session cookie found - will show login form")
 
         st.session_state.login_cookie_check = True
 
-
-
-        auth_url = azure_auth.get_auth_url()
-        html_button = f"""
-        <div style="text-align: center; margin: 20px 0;">
-            <a href="{auth_url}" target="_self" style="
-                display: inline-block;
-                background-color: #0078d4;
-                color: white;
-                padding: 12px 24px;
-                text-decoration: none;
-                border-radius: 4px;
-                font-weight: bold;
-                font-size: 16px;
-                border: none;
-                cursor: pointer;
-            ">Logg inn med Microsoft</a>
-        </div>
-        """
-        st.html(html_button)
+    auth_url = azure_auth.get_auth_url()
+    html_button = f"""
+    <div style="text-align: center; margin: 20px 0;">
+        <a href="{auth_url}" target="_self" style="
+            display: inline-block;
+            background-color: #0078d4;
+            color: white;
+            padding: 12px 24px;
+            text-decoration: none;
+            border-radius: 4px;
+            font-weight: bold;
+            font-size: 16px;
+            border: none;
+            cursor: pointer;
+        ">Logg inn med Microsoft</a>
+    </div>
+    """
+    st.html(html_button)
 
 def show_logout_button():
     """Show logout button."""
@@ -203,6 +246,12 @@ def get_current_user():
     """Get current user info."""
     return st.session_state.get('user_info')
 
+@st.cache_resource(ttl=3600, show_spinner=False)
+def run_session_cleanup():
+    """Run cleanup_expired_sessions at most once per hour for the whole process."""
+    cleanup_expired_sessions()
+    return True
+
 def cleanup_expired_sessions():
     """Cleanup expired sessions."""
     try:
@@ -221,7 +270,21 @@ def cleanup_expired_sessions():
             # Log cleanup results
             rows_affected = result.rowcount
             if rows_affected > 0:
-                print(f"🧹 Cleaned up {rows_affected} expired sessions")
+                logger.info("🧹 Cleaned up %d expired sessions", rows_affected)
+
+        # Delete sessions expired for over a day in small batches to avoid lock escalation
+        deleted = 0
+        while True:
+            with engine.begin() as conn:
+                result = conn.execute(text("""
+                    DELETE TOP (1000) FROM user_sessions
+                    WHERE expires_at < DATEADD(day, -1, GETDATE())
+                """))
+            deleted += result.rowcount
+            if result.rowcount < 1000:
+                break
+        if deleted > 0:
+            logger.info("🧹 Deleted %d old sessions", deleted)
 
     except Exception as e:
-        print(f"⚠️ Session cleanup failed: {e}")
\ No newline at end of file
+        logger.warning("⚠️ Session cleanup failed: %s", e)
\ No newline at end of file
@@ -1,15 +1,25 @@
 """
 Simple Session Management for Streamlit Authentication with Cookie Fallback
+
+Set SESSION_SECRET to a dedicated random value to issue signed session tokens
+that are validated without a database lookup. Without it, sessions use a
+random id that is validated against the user_sessions table.
 """
 
 import streamlit as st
-import pandas as pd
+import jwt
+import logging
+import os
+import time
 import uuid
 import json
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
+from sqlalchemy import text
 from streamlit_cookies_manager import EncryptedCookieManager
 
+logger = logging.getLogger(__name__)
+
 # Initialize cookies at module level
 cookies = EncryptedCookieManager(
     prefix="kursadmin_",
@@ -19,6 +29,50 @@ cookies = EncryptedCookieManager(
 if not cookies.ready():
     st.stop()
 
+# Set once the user_sessions DDL has run in this process
+_TABLE_READY = False
+
+# Recently validated sessions: session_id -> (validated_at, user_info)
+_SESSION_CACHE: Dict[str, tuple] = {}
+SESSION_CACHE_TTL = 30  # seconds
+SESSION_CACHE_MAX = 1000
+
+SESSION_TOKEN_ALGORITHM = "HS256"
+
+def _session_secret() -> Optional[str]:
+    """Key for signing session tokens (read lazily so .env has been loaded)."""
+    return os.getenv('SESSION_SECRET')
+
+# The only user_info fields read after login; everything else Graph returns is left out of sessions
+_SESSION_FIELDS = ('id', 'displayName', 'mail', 'userPrincipalName')
+
+INSERT_SESSION = text("""
+INSERT INTO user_sessions (session_id, user_id, user_info, expires_at, is_active)
+VALUES (:session_id, :user_id, :user_info, :expires_at, 1)
+""")
+
+def _update_cookies(**changes):
+    """Apply cookie changes and write them with a single save(); a value of None deletes the cookie."""
+    for name, value in changes.items():
+        if value is None:
+            if name in cookies:
+                del cookies[name]
+        else:
+            cookies[name] = value
+    cookies.save()
+
+    # Keep this rerun's snapshot in line with what was written
+    snapshot = st.session_state.get('_cookie_snapshot')
+    if snapshot is not None:
+        snapshot.update(changes)
+
+def _cookie(name: str) -> Optional[str]:
+    """Read a cookie from this rerun's snapshot, falling back to the cookie manager."""
+    snapshot = st.session_state.get('_cookie_snapshot')
+    if snapshot is not None and name in snapshot:
+        return snapshot[name]
+    return cookies.get(name)
+
 class SessionManager:
     """Simple session manager with HTTP cookies and fallback authentication."""
 
@@ -29,7 +83,11 @@ class SessionManager:
         self._ensure_session_table_exists()
 
     def _ensure_session_table_exists(self):
-        """Create/recreate sessions table with correct structure."""
+        """Create sessions table if missing (once per process)."""
+        global _TABLE_READY
+        if _TABLE_READY:
+            return
+
         recreate_table_sql = """
         IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='user_sessions' AND xtype='U')
         BEGIN
@@ -41,17 +99,26 @@ class SessionManager:
                 is_active BIT DEFAULT 1
             );
         END
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_sessions_live' AND object_id=OBJECT_ID('user_sessions'))
+        BEGIN
+            CREATE INDEX IX_sessions_live ON user_sessions(expires_at) WHERE is_active = 1;
+        END
         """
 
         try:
             import app
-            from sqlalchemy import text
             engine = app.get_engine()
-            with engine.connect() as conn:
+            with engine.begin() as conn:
                 conn.execute(text(recreate_table_sql))
-                conn.commit()
+            _TABLE_READY = True
         except Exception as e:
-            print(f"⚠️ Could not create session table: {e}")
+            logger.warning("⚠️ Could not create session table: %s", e)
+
+    def prime_cookie_cache(self):
+        """Snapshot the session cookies once per rerun so later reads skip the cookie manager."""
+        st.session_state['_cookie_snapshot'] = {
+            name: cookies.get(name) for name in (self.cookie_name, self.user_info_cookie)
+        }
 
     def create_session(self, user_info: Dict[str, Any]) -> str:
         """Create a new session with enhanced cookie storage."""
@@ -60,29 +127,44 @@ class SessionManager:
             expires_at = datetime.now() + timedelta(hours=24)
             
             # Add expiration to user info for cookie storage
-            enhanced_user_info = user_info.copy()
-            enhanced_user_info['expires_at'] = expires_at.isoformat()
+            session_user = {k: user_info.get(k) for k in _SESSION_FIELDS}
+            enhanced_user_info = dict(session_user, expires_at=expires_at.isoformat())
+
+            # Serialize once; set_session_cookie reuses the same string for the cookie
+            user_info_json = json.dumps(enhanced_user_info)
+            st.session_state['_user_info_json'] = user_info_json
 
             # Try to store in database (don't fail if database is down)
             try:
                 session_data = {
                     'session_id': session_id,
                     'user_id': user_info.get('id', 'unknown'),
-                    'user_info': json.dumps(enhanced_user_info),
-                    'expires_at': expires_at,
-                    'is_active': True
+                    'user_info': user_info_json,
+                    'expires_at': expires_at
                 }
                 import app
                 engine = app.get_engine()
-                df = pd.DataFrame([session_data])
-                df.to_sql('user_sessions', engine, if_exists='append', index=False)
-                print("✅ Session stored in database")
+                with engine.begin() as conn:
+                    conn.execute(INSERT_SESSION, session_data)
+                logger.debug("✅ Session stored in database")
             except Exception as db_error:
-                print(f"⚠️ Database storage failed, continuing with cookie-only session: {db_error}")
+                logger.warning("⚠️ Database storage failed, continuing with cookie-only session: %s", db_error)
+
+            # Hand out a signed token so reruns can validate without the database
+            secret = _session_secret()
+            if secret:
+                claims = {
+                    'sub': user_info.get('id', 'unknown'),
+                    'name': user_info.get('displayName'),
+                    'jti': session_id,
+                    'user': session_user,
+                    'exp': int(expires_at.timestamp())
+                }
+                return jwt.encode(claims, secret, algorithm=SESSION_TOKEN_ALGORITHM)
 
             return session_id
         except Exception as e:
-            print(f"❌ Failed to create session: {e}")
+            logger.error("❌ Failed to create session: %s", e)
             return None
 
     def validate_session(self, session_id: str) -> Optional[Dict[str, Any]]:
@@ -90,29 +172,62 @@ class SessionManager:
         if not session_id:
             return None
 
+        # Signed tokens are verified locally; only legacy uuid sessions need the database
+        if session_id.count('.') == 2:
+            return self._try_token_validation(session_id)
+
+        # Reruns within a few seconds reuse the last database result
+        cached = _SESSION_CACHE.get(session_id)
+        if cached and time.monotonic() - cached[0] < SESSION_CACHE_TTL:
+            return cached[1]
+
         # Try database first
         user_info = self._try_database_validation(session_id)
         if user_info:
-            print("✅ Used database session authentication")
+            logger.debug("✅ Used database session authentication")
+            self._cache_session(session_id, user_info)
             return user_info
 
         # Fallback: Try cookie-stored user info
         user_info = self._try_cookie_validation()
         if user_info:
-            print("✅ Using cookie fallback authentication")
+            logger.debug("✅ Using cookie fallback authentication")
             return user_info
 
         return None
 
+    def _cache_session(self, session_id: str, user_info: Dict[str, Any]):
+        """Remember a database-validated session for SESSION_CACHE_TTL seconds."""
+        now = time.monotonic()
+        if len(_SESSION_CACHE) >= SESSION_CACHE_MAX:
+            # Drop expired entries so the cache stays bounded
+            for key, (validated_at, _) in list(_SESSION_CACHE.items()):
+                if now - validated_at >= SESSION_CACHE_TTL:
+                    _SESSION_CACHE.pop(key, None)
+        _SESSION_CACHE[session_id] = (now, user_info)
+
+    def _try_token_validation(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verify a signed session token; expired or tampered tokens are rejected."""
+        secret = _session_secret()
+        if not secret:
+            return None
+        try:
+            claims = jwt.decode(token, secret, algorithms=[SESSION_TOKEN_ALGORITHM])
+        except jwt.InvalidTokenError as e:
+            logger.debug("Session token rejected: %s", e)
+            return None
+        user_info = dict(claims.get('user') or {})
+        user_info['expires_at'] = datetime.fromtimestamp(claims['exp']).isoformat()
+        return user_info
+
     def _try_database_validation(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Try to validate via database."""
         try:
             import app
-            from sqlalchemy import text
             engine = app.get_engine()
 
             query = """
-            SELECT user_info, expires_at FROM user_sessions
+            SELECT TOP 1 user_info, expires_at FROM user_sessions
             WHERE session_id = :session_id AND is_active = 1 AND expires_at > GETDATE()
             """
 
@@ -124,19 +239,26 @@ class SessionManager:
                     user_info_json, expires_at = row
                     return json.loads(user_info_json)
         except Exception as e:
-            print(f"⚠️ Database validation failed: {e}")
+            logger.warning("⚠️ Database validation failed: %s", e)
+            logger.debug("Validation traceback", exc_info=True)
         return None
 
     def _try_cookie_validation(self) -> Optional[Dict[str, Any]]:
         """Try to validate via cookie-stored user info."""
         try:
-            user_info_json = cookies.get(self.user_info_cookie)
+            user_info_json = _cookie(self.user_info_cookie)
             if not user_info_json:
                 return None
 
-            user_info = json.loads(user_info_json)
-            print("✅ Found user info in cookies")
-            print(f"User info from cookie: {user_info}")
+            # Reruns see the same cookie string, so only decode it when it changes
+            if st.session_state.get('_cached_cookie_raw') == user_info_json:
+                user_info = st.session_state['_cached_cookie_dict']
+            else:
+                user_info = json.loads(user_info_json)
+                st.session_state['_cached_cookie_raw'] = user_info_json
+                st.session_state['_cached_cookie_dict'] = user_info
+                logger.debug("✅ Found user info in cookies")
+                logger.debug("User info from cookie: %s", user_info)
             
             # Check if cookie has expired
             expires_at_str = user_info.get('expires_at')
@@ -144,43 +266,47 @@ class SessionManager:
                 expires_at = datetime.fromisoformat(expires_at_str)
                 if datetime.now() >= expires_at:
                     # Clean up expired cookie
-                    if self.user_info_cookie in cookies:
-                        del cookies[self.user_info_cookie]
+                    _update_cookies(**{self.user_info_cookie: None})
                     return None
 
             return user_info
         except Exception as e:
-            print(f"⚠️ Cookie validation failed: {e}")
+            logger.warning("⚠️ Cookie validation failed: %s", e)
+            logger.debug("Validation traceback", exc_info=True)
             # Clean up corrupted cookie
-            if self.user_info_cookie in cookies:
-                del cookies[self.user_info_cookie]
+            _update_cookies(**{self.user_info_cookie: None})
         return None
 
     def set_session_cookie(self, session_id: str):
         """Set persistent cookies with session ID and user info."""
         # Set session ID cookie
-        cookies[self.cookie_name] = session_id
-        
+        changes = {self.cookie_name: session_id}
+
         # NEW: Also store user info in cookie for fallback
+        user_info_json = st.session_state.pop('_user_info_json', None)
         user_info = st.session_state.get('user_info')
-        if user_info:
-            enhanced_user_info = user_info.copy()
+        if user_info_json is None and user_info:
+            enhanced_user_info = {k: user_info.get(k) for k in _SESSION_FIELDS}
             expires_at = st.session_state.get('token_expiry', datetime.now() + timedelta(hours=24))
             enhanced_user_info['expires_at'] = expires_at.isoformat()
-            cookies[self.user_info_cookie] = json.dumps(enhanced_user_info)
+            user_info_json = json.dumps(enhanced_user_info)
+        if user_info_json:
+            changes[self.user_info_cookie] = user_info_json
 
-        cookies.save()
+        _update_cookies(**changes)
         st.session_state.current_session_id = session_id
 
     def get_session_cookie(self) -> Optional[str]:
         """Get session ID from cookie."""
-        # Check session state first
+        # Check session state first; an authenticated session was validated when it was restored
         session_id = st.session_state.get('current_session_id')
+        if session_id and st.session_state.get('authenticated'):
+            return session_id
         if session_id and self.validate_session(session_id):
             return session_id
 
         # Read from cookie manager
-        cookie_value = cookies.get(self.cookie_name)
+        cookie_value = _cookie(self.cookie_name)
         if cookie_value and self.validate_session(cookie_value):
             st.session_state.current_session_id = cookie_value
             return cookie_value
@@ -189,34 +315,30 @@ class SessionManager:
 
     def clear_session_cookie(self):
         """Clear all session cookies and state."""
-        print(f"🧹 CLEAR SESSION: Starting cookie and session cleanup...")
+        logger.debug("🧹 CLEAR SESSION: Starting cookie and session cleanup...")
 
-        # Clear cookies
-        for cookie_name in [self.cookie_name, self.user_info_cookie]:
-            if cookie_name in cookies:
-                print(f"🧹 CLEAR SESSION: Found cookie {cookie_name}, deleting...")
-                del cookies[cookie_name]
+        # Forget the cached validation so the session can't be reused after logout
+        for session_id in (st.session_state.get('current_session_id'), _cookie(self.cookie_name)):
+            if session_id:
+                _SESSION_CACHE.pop(session_id, None)
 
-        cookies.save()
-        print(f"✅ Session cookies cleared from cookie manager and browser")
+        # Clear cookies
+        _update_cookies(**{self.cookie_name: None, self.user_info_cookie: None})
+        logger.debug("✅ Session cookies cleared from cookie manager and browser")
 
         # Clear session state
-        keys_to_clear = ['current_session_id', 'authenticated', 'user_info', 'access_token', 'token_expiry', 'auth_timestamp']
+        keys_to_clear = ['current_session_id', 'authenticated', 'user_info', 'access_token', 'token_expiry', 'auth_timestamp',
+                         '_user_info_json', '_cached_cookie_raw', '_cached_cookie_dict']
         cleared_keys = []
         for key in keys_to_clear:
             if key in st.session_state:
                 del st.session_state[key]
                 cleared_keys.append(key)
 
-        print(f"✅ Session state cleared: {cleared_keys}")
-        print(f"🧹 CLEAR SESSION: Cleanup completed")
-# Global session manager instance
-session_manager = None
-
+        logger.debug("✅ Session state cleared: %s", cleared_keys)
+        logger.debug("🧹 CLEAR SESSION: Cleanup completed")
+@st.cache_resource
 def get_session_manager():
-    """Get the global session manager instance."""
-    global session_manager
-    if session_manager is None:
-        import app
-        session_manager = SessionManager(app.get_engine)
-    return session_manager
\ No newline at end of file
+    """Get the process-wide session manager instance."""
+    import app
+    return SessionManager(app.get_engine)
\ No newline at end of file